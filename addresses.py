@@ -1,37 +1,60 @@
+import concurrent.futures
+import copy
+import io
 import json
+import re
+import numpy as np
 import pandas as pd
 from docx import Document
 from docx.shared import Pt
+from docx.text.run import Run
 import os
 import logging
 from logging.handlers import RotatingFileHandler
 
 
+# Columns the document rendering actually uses.
+USED_COLUMNS = ["billing_name", "state_city", "address", "phone", "postcode", "status"]
+
+def configure_columns(column_headers):
+    """Build the header lookup tables for read_excel once."""
+    global USED_HEADERS, READ_DTYPE
+    USED_HEADERS = {column_headers[name].strip(): name for name in USED_COLUMNS}
+    READ_DTYPE = {column_headers[name]: "string" for name in USED_COLUMNS}
+
 def read_excel(excel_file):
     """Load the Excel file and filter rows based on status."""
     try:
-        df = pd.read_excel(excel_file)
+        read_kwargs = {
+            "usecols": lambda header: str(header).strip() in USED_HEADERS,
+            "dtype": READ_DTYPE
+        }
+        try:
+            df = pd.read_excel(excel_file, engine='calamine', **read_kwargs)
+        except ImportError:
+            logging.warning("python-calamine is not installed; falling back to the default engine.")
+            df = pd.read_excel(excel_file, **read_kwargs)
         df.columns = df.columns.str.strip()
         logging.info("Excel file loaded successfully.")
 
-        if len(df.columns) != len(COLUMN_HEADERS):
-            logging.error(f"Expected {len(COLUMN_HEADERS)} columns, but found {len(df.columns)}.")
+        missing = set(USED_HEADERS) - set(df.columns)
+        if missing:
+            logging.error("Missing expected columns in the Excel file: %s.", sorted(missing))
             return None
-        
-        column_mapping = {old_name: new_name for old_name, new_name in zip(df.columns, COLUMN_HEADERS)}
-        df.rename(columns=column_mapping, inplace=True)
+
+        df.rename(columns=USED_HEADERS, inplace=True)
         logging.info("Column names mapped successfully.")
         
         df = filter_processing_orders(df)
         return df
     except FileNotFoundError:
-        logging.error(f"Excel file '{excel_file}' not found.")
+        logging.error("Excel file '%s' not found.", excel_file)
         return None
     except ValueError as ve:
-        logging.error(f"Value error while processing Excel file: {ve}")
+        logging.error("Value error while processing Excel file: %s", ve)
         return None
     except Exception as e:
-        logging.error(f"Error loading Excel file '{excel_file}': {e}")
+        logging.error("Error loading Excel file '%s': %s", excel_file, e)
         return None
 
 def filter_processing_orders(df):
@@ -40,85 +63,172 @@ def filter_processing_orders(df):
         logging.error("The 'status' column is missing from the DataFrame.")
         return pd.DataFrame()  # Return an empty DataFrame if 'status' is not found
     
-    filtered_df = df[df['status'].str.strip().str.lower() == PROCESSING_STATUS]
-    logging.info(f"Filtered DataFrame to {len(filtered_df)} rows with status '{PROCESSING_STATUS}'.")
+    # Normalize only the (few) distinct status values, then compare category codes.
+    status_cat = df['status'].astype('category')
+    normalized = status_cat.cat.categories.str.strip().str.lower()
+    target_codes = np.where(normalized == PROCESSING_STATUS)[0]
+    mask = np.isin(status_cat.cat.codes.to_numpy(), target_codes)
+    # Materialize the selection contiguously so downstream .to_numpy() calls
+    # return dense arrays instead of gathered views.
+    filtered_df = df.iloc[mask].reset_index(drop=True)
+    logging.info("Filtered DataFrame to %d rows with status '%s'.", len(filtered_df), PROCESSING_STATUS)
     return filtered_df
 
-def find_and_replace(doc, find_text, replace_text):
-    """Find and replace text in the document."""
-    replaced = replace_in_paragraphs(doc.paragraphs, find_text, replace_text)
-
-    if not replaced:
-        for table in doc.tables:
-            for row in table.rows:
-                for cell in row.cells:
-                    if replace_in_paragraphs(cell.paragraphs, find_text, replace_text):
-                        logging.info(f"Replaced '{find_text}' with '{replace_text}' in Document.")
-                        return doc
+# 10-digit mobile numbers that lost their leading zero in Excel.
+MOBILE_RE = re.compile(r'^(9\d{9})$')
+
+def normalize_phone(series):
+    """Strip the float '.0' artifact and prepend '0' to 10-digit mobile numbers."""
+    phone = series.astype('string').str.strip().str.removesuffix('.0')
+    return phone.str.replace(MOBILE_RE, r'0\1', regex=True).fillna('')
+
+def build_render_frame(df):
+    """Fuse all per-row string prep into one vectorized stage.
+
+    Returns a frame with exactly the four final strings the renderer needs,
+    so the render loop does no string logic of its own.
+    """
+    # Collapse 'state، city' to just the state when both parts are identical.
+    state_city = df['state_city'].astype('string').str.strip()
+    parts = state_city.str.split('،', n=1, expand=True)
+    if len(parts.columns) > 1:
+        same = parts[0].str.strip().eq(parts[1].str.strip())
+        state_city = state_city.mask(same.fillna(False), parts[0].str.strip())
+
+    postcode = df['postcode'].astype('string').str.strip()
+    return pd.DataFrame({
+        'name_out': df['billing_name'].astype('string').fillna(''),
+        'address_out': state_city.fillna('') + '، ' + df['address'].astype('string').fillna(''),
+        'phone_out': normalize_phone(df['phone']),
+        'postcode_out': postcode.str.removesuffix('.0').fillna('')
+    })
+
+def template_placeholders(doc):
+    """Collect the set of placeholders that actually occur in a document."""
+    texts = doc.element.xpath('.//w:t[contains(text(), "__")]')
+    return set(re.findall(r'__\w+__', '\n'.join(t.text for t in texts)))
+
+# The four placeholders the templates use; compiled once at import.
+PLACEHOLDER_RE = re.compile(r'__(?:name|address|phone|postcode)__')
+
+def apply_mapping(doc, mapping):
+    """Replace every placeholder of the mapping in a single pass over the document."""
+    if not mapping:
+        return doc
+
+    def substitute(match):
+        key = match.group(0)
+        if key in mapping:
+            matched_keys.append(key)
+            return mapping[key]
+        return key
+
+    # One XPath query yields only the <w:t> nodes that can hold a placeholder,
+    # covering body paragraphs and table cells without building run wrappers.
+    for t_elem in doc.element.xpath('.//w:t[contains(text(), "__")]'):
+        matched_keys = []
+        new_text = PLACEHOLDER_RE.sub(substitute, t_elem.text)
+        if matched_keys:
+            t_elem.text = new_text
+            set_run_style(Run(t_elem.getparent(), None), matched_keys[0])
+            logging.info("Replaced %s in Document.", matched_keys)
     return doc
 
-def replace_in_paragraphs(paragraphs, find_text, replace_text):
-    """Replace text in specified paragraphs."""
-    for paragraph in paragraphs:
-        for run in paragraph.runs:
-            if find_text in run.text:
-                run.text = run.text.replace(find_text, replace_text, 1)
-                set_run_style(run, find_text)
-                return True
-    return False
+def configure_fonts(font_config):
+    """Resolve font settings once so the replace loop avoids repeated dict lookups."""
+    global FONT_NAME, FONT_ADDR, FONT_SIZE, STYLE_FOR
+    FONT_NAME = font_config['name']
+    FONT_ADDR = font_config['address_text']
+    FONT_SIZE = Pt(font_config['size1'])
+    STYLE_FOR = {
+        '__name__': FONT_NAME,
+        '__address__': FONT_ADDR,
+        '__phone__': FONT_ADDR,
+        '__postcode__': FONT_ADDR
+    }
 
 def set_run_style(run, find_text):
     """Set font style for the run."""
-    if find_text == '__name__':
-        run.font.name = config['font']['name']
-    else:
-        run.font.name = config['font']['address_text']
-    run.font.size = Pt(config['font']['size1'])
+    run.font.name = STYLE_FOR.get(find_text, FONT_ADDR)
+    run.font.size = FONT_SIZE
 
 def read_doc_file(doc_path):
     """Read the Word document."""
-    if not os.path.exists(doc_path):
-        logging.error(f"The file '{doc_path}' does not exist.")
-        raise FileNotFoundError(f"The file '{doc_path}' does not exist.")
-    
-    return Document(doc_path)
+    try:
+        with open(doc_path, 'rb') as doc_file:
+            return Document(doc_file)
+    except FileNotFoundError:
+        logging.error("The file '%s' does not exist.", doc_path)
+        raise
 
-def save_doc_file(doc_path, doc):
-    """Save the modified Word document."""
-    modified_doc_path = os.path.basename(ADDRESS_DOC_FILENAME)
-    doc.save(modified_doc_path)
-    logging.info(f"Modified document saved as '{modified_doc_path}'.")
+def save_doc_file(doc, doc_path):
+    """Serialize a filled Word document in memory, then write it in one call."""
+    buf = io.BytesIO()
+    doc.save(buf)
+    with open(doc_path, 'wb') as out_file:
+        out_file.write(buf.getvalue())
+    logging.info("Modified document saved as '%s'.", doc_path)
 
-def process_replacements(doc, df):
-    """Process replacements for each row in the DataFrame."""
-    for index, row in df.iterrows():
-        try:
-            doc = replace_placeholder(doc, '__name__', str(row['billing_name']))
-            result = row['state_city'].split('،')
-            if result[0].strip() == result[1].strip():
-                row['state_city'] = result[0].strip()
-            doc = replace_placeholder(doc, '__address__', f"{row['state_city']}، {row['address']}")
-
-            # Process phone number
-            phone_number = str(row['phone']).strip() if pd.notna(row['phone']) else ''
-            if phone_number.endswith('.0'):
-                phone_number = phone_number[:-2]  # Remove the '.0' part
-            if phone_number.startswith('9') and len(phone_number) == 10:
-                phone_number = '0' + phone_number  # Prepend '0' if it starts with '9'
-            doc = replace_placeholder(doc, '__phone__', phone_number)
-
-            # Process postcode
-            postcode = str(row['postcode']).strip() if pd.notna(row['postcode']) else ''
-            if postcode.endswith('.0'):
-                postcode = postcode[:-2]  # Remove the '.0' part
-            doc = replace_placeholder(doc, '__postcode__', postcode)
-        except Exception as e:
-            logging.error(f"Failed to process row {index}: {e}")
-    return doc
+def order_doc_path(index):
+    """Build the output path for the document of one order."""
+    base, ext = os.path.splitext(os.path.basename(ADDRESS_DOC_FILENAME))
+    return f"{base}_{index + 1}{ext}"
+
+# Parsed template held per worker process, set by _init_render_worker.
+_TEMPLATE = None
+
+def _init_render_worker(template_bytes, font_config):
+    """Parse the template and resolve fonts once per worker process."""
+    global _TEMPLATE
+    _TEMPLATE = Document(io.BytesIO(template_bytes))
+    configure_fonts(font_config)
+
+def render_order(task):
+    """Fill and save the document for a single order (runs in a worker process)."""
+    mapping, doc_path = task
+    try:
+        doc = copy.deepcopy(_TEMPLATE)
+        apply_mapping(doc, mapping)
+        save_doc_file(doc, doc_path)
+    except Exception as e:
+        logging.error("Failed to render '%s': %s", doc_path, e)
+
+def process_replacements(template, render_frame):
+    """Fill a copy of the template for each row of the render frame."""
+    # Placeholders missing from the template would cost a full document walk
+    # per row; compute the present set once and replace only those.
+    present = template_placeholders(template)
+    if not present:
+        logging.warning("The template contains no placeholders; nothing to render.")
+        return
 
-def replace_placeholder(doc, placeholder, replacement):
-    """Replace a placeholder in the document."""
-    return find_and_replace(doc, placeholder, replacement)
+    names = render_frame['name_out'].to_numpy()
+    addresses = render_frame['address_out'].to_numpy()
+    phones = render_frame['phone_out'].to_numpy()
+    postcodes = render_frame['postcode_out'].to_numpy()
+
+    tasks = []
+    for index, (name, address, phone, postcode) in enumerate(
+            zip(names, addresses, phones, postcodes)):
+        mapping = {
+            '__name__': name,
+            '__address__': address,
+            '__phone__': phone,
+            '__postcode__': postcode
+        }
+        mapping = {key: value for key, value in mapping.items() if key in present}
+        tasks.append((mapping, order_doc_path(index)))
+
+    # Serialize the template once; each worker re-parses it a single time.
+    buf = io.BytesIO()
+    template.save(buf)
+    template_bytes = buf.getvalue()
+
+    with concurrent.futures.ProcessPoolExecutor(
+            max_workers=os.cpu_count(),
+            initializer=_init_render_worker,
+            initargs=(template_bytes, config['font'])) as executor:
+        list(executor.map(render_order, tasks, chunksize=16))
 
 if __name__ == "__main__":
     try:
@@ -150,14 +260,16 @@ if __name__ == "__main__":
             from mapping import PERSIAN_STATUS, PERSIAN_COLUMN_HEADERS
             PROCESSING_STATUS = PERSIAN_STATUS['processing']
             COLUMN_HEADERS = PERSIAN_COLUMN_HEADERS
-        
-        doc = read_doc_file(DOC_TEMPLATE_PATH)
+
+        configure_fonts(config['font'])
+        configure_columns(COLUMN_HEADERS)
+
+        template = read_doc_file(DOC_TEMPLATE_PATH)
         df = read_excel(EXCEL_FILE_PATH)
-        
+
         if df is not None and not df.empty:
-            doc = process_replacements(doc, df)
-            save_doc_file(DOC_TEMPLATE_PATH, doc)
+            process_replacements(template, build_render_frame(df))
         else:
             logging.warning("No valid data found in the Excel file.")
     except Exception as e:
-        logging.error(f"An error occurred: {e}")
\ No newline at end of file
+        logging.error("An error occurred: %s", e)
\ No newline at end of file
@@ -5,27 +5,39 @@ import logging
 import requests
 import jdatetime
 import concurrent.futures
+import woocommerce.api
+from requests.adapters import HTTPAdapter
 from woocommerce import API
-from typing import List, Any
-from openpyxl import Workbook, load_workbook
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
 from openpyxl.utils import get_column_letter
-from openpyxl.styles import PatternFill, Border, Side, Font, Alignment
+from openpyxl.styles import PatternFill, Border, Side, Font, Alignment, NamedStyle
 from datetime import datetime
 from logging.handlers import RotatingFileHandler
 
-def get_key_by_value(d, value):
-    """Return the key associated with the given value in the dictionary."""
-    for key, val in d.items():
-        if val == value:
-            return key
-    return None
+# Columns that receive month and grand totals.
+SUM_COLUMNS = [
+    "address",
+    "postcode",
+    "total",
+    "shipping",
+    "discount",
+    "sepidar_discount",
+    "item_total",
+    "com_postal_payment",
+    "com_postage"
+]
+
+def _to_float(value):
+    """Parse a numeric string, treating anything unparsable as zero."""
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0.0
 
-def find_meta_value(data, target_key):
-    """Function to find the value for a specific key in meta_data"""
-    for item in data.get('meta_data', []):
-        if item['key'] == target_key:
-            return item['value']
-    return None
+def order_meta(order):
+    """Collapse an order's meta_data list into a key -> value dict."""
+    return {item['key']: item['value'] for item in order.get('meta_data', [])}
 
 def validate_config(config):
     """Validate the loaded configuration."""
@@ -74,7 +86,20 @@ def load_config(json_file):
 
     fonts = {name: Font(name=config["font"][name]) for name in config["font"]}
 
-    return {"lang": config['lang']}, wc_api, days_to_fetch, color, borders, fonts
+    # The shared cell-style pool, built once from the configured colors and
+    # borders; cell styling then happens by name lookup.
+    styles = [
+        NamedStyle(name="header", fill=color["header_bg"], border=borders["all_borders"]),
+        NamedStyle(name="order_cell", fill=color["order_bg"], border=borders["all_borders"]),
+        NamedStyle(name="money_order", fill=color["order_bg"], border=borders["all_borders"], number_format='#,0'),
+        NamedStyle(name="text_order", fill=color["order_bg"], border=borders["all_borders"], number_format='@'),
+        NamedStyle(name="sum_row", fill=color["sum_row_bg"], border=borders["all_borders"]),
+        NamedStyle(name="sum_row_money", fill=color["sum_row_bg"], border=borders["all_borders"], number_format='#,0'),
+        NamedStyle(name="total_sum", fill=color["total_sum_bg"], border=borders["all_borders"]),
+        NamedStyle(name="total_sum_money", fill=color["total_sum_bg"], border=borders["all_borders"], number_format='#,0')
+    ]
+
+    return {"lang": config['lang']}, wc_api, days_to_fetch, color, borders, fonts, styles
 
 def convert_to_jalali(date_string):
     """Convert ISO date string to Jalali date format."""
@@ -84,39 +109,22 @@ def convert_to_jalali(date_string):
                                                month=gregorian_date.month, day=gregorian_date.day)
     return jalali_date, time_part
 
-def apply_styles(sheet, row_index, order):
-    """Apply styles to a specific row in the sheet."""
-    for cell in sheet[row_index]:
-        cell.fill = color["order_bg"]
-        cell.border = borders["all_borders"]
-
-    if int(order['discount_total']) > 0:
-        sheet[row_index][list(COLUMN_HEADERS.keys()).index("sepidar_discount")].fill = color["red_bg"]
-
-    for col in ["total", "shipping", "discount", "sepidar_discount", "com_postal_payment", "com_postage"]:
-        sheet.cell(row=row_index, column=list(COLUMN_HEADERS.keys()).index(col) + 1).number_format = '#,0'
-
-    for col in ["date_paid", "phone", "postcode"]:
-        sheet.cell(row=row_index, column=list(COLUMN_HEADERS.keys()).index(col) + 1).number_format = '@'
+def register_named_styles(workbook):
+    """Register the prebuilt styles on the workbook once; assignments become name lookups."""
+    for style in styles:
+        if style.name not in workbook.named_styles:
+            workbook.add_named_style(style)
 
-def fetch_page(master_page: str, params: dict, max_retries: int = 3) -> list:
-    """Fetch orders from WooCommerce API from a specific page with retry logic and increasing timeouts."""
+def fetch_page(master_page: str, params: dict, max_retries: int = 3) -> tuple:
+    """Fetch one page of orders plus response headers, with retry logic and increasing timeouts."""
     for attempt in range(max_retries):
         try:
             # Increase timeout by 5 seconds for each retry attempt
-            current_timeout = wc_api['TIMEOUT'] + (5 * attempt)
-            
-            wcapi = API(
-                url=wc_api['URL'],
-                consumer_key=wc_api['KEY'],
-                consumer_secret=wc_api['SECRET'],
-                wp_api=True,
-                version="wc/v3",
-                timeout=current_timeout,  # Use the increased timeout
-            )
-            response = wcapi.get(master_page, params=params)
+            wc_client.timeout = wc_api['TIMEOUT'] + (5 * attempt)
+
+            response = wc_client.get(master_page, params=params)
             response.raise_for_status()
-            return response.json()
+            return response.json(), response.headers
         
         except requests.exceptions.Timeout:
             if attempt < max_retries - 1:
@@ -125,7 +133,7 @@ def fetch_page(master_page: str, params: dict, max_retries: int = 3) -> list:
                 continue
             else:
                 logging.error(f"Timeout after {max_retries} attempts on page {params['page']}")
-                return []
+                return [], {}
         
         except requests.exceptions.ConnectionError:
             if attempt < max_retries - 1:
@@ -134,19 +142,19 @@ def fetch_page(master_page: str, params: dict, max_retries: int = 3) -> list:
                 continue
             else:
                 logging.error(f"Connection error after {max_retries} attempts on page {params['page']}")
-                return []
+                return [], {}
         
         except requests.exceptions.HTTPError as http_err:
             logging.error(f"HTTP error occurred on page {params['page']}: {http_err}")
-            return []
+            return [], {}
         
         except requests.exceptions.RequestException as req_err:
             logging.error(f"An error occurred while fetching page {params['page']}: {req_err}")
-            return []
+            return [], {}
         
         except Exception as e:
             logging.error(f"An unexpected error occurred on page {params['page']}: {e}")
-            return []
+            return [], {}
 
 def fetch_orders():
     """Fetch orders from WooCommerce API with improved pagination using concurrency."""
@@ -163,48 +171,50 @@ def fetch_orders():
 
     logging.info(f"Fetching orders since: {iso_date_min}, {convert_to_jalali(iso_date_min)}")
 
-    all_orders = []
-    page = 1
-    futures = []
-
-    with concurrent.futures.ThreadPoolExecutor() as executor:
-        while True:
-            # Submit a new task for the current page
-            futures.append(executor.submit(fetch_page,
-             master_page = "orders",
-             params={"after": iso_date_min, "per_page": wc_api['PER_PAGE'], "page": page}))
-            page += 1
-            
-            # Check if we have a limit on the number of pages to fetch
-            if page > 10:  # Example: limit to 10 pages
-                break
-
-        # Collect results as they complete
-        for future in concurrent.futures.as_completed(futures):
-            orders = future.result()
-            if orders:
-                all_orders.extend(orders)
+    base_params = {"after": iso_date_min, "per_page": wc_api['PER_PAGE']}
+
+    # Fetch page 1 synchronously to learn how many pages actually exist.
+    all_orders, headers = fetch_page("orders", {**base_params, "page": 1})
+    try:
+        total_pages = int(headers.get('X-WP-TotalPages', 1))
+    except (TypeError, ValueError):
+        total_pages = 1
+    logging.info(f"Total pages to fetch: {total_pages}")
+
+    if total_pages > 1:
+        # A small bounded pool keeps the shop responsive and matches the
+        # shared session's per-host connection pool; map() also hands pages
+        # back in order without holding futures for every page at once.
+        with concurrent.futures.ThreadPoolExecutor(max_workers=6) as executor:
+            page_results = executor.map(
+                lambda page: fetch_page("orders", {**base_params, "page": page}),
+                range(2, total_pages + 1))
+            for orders, _ in page_results:
+                if orders:
+                    all_orders.extend(orders)
 
     return all_orders
 
-def create_order_row(order):
-    """Create a row of data for an order."""
+def create_order_row(order, jalali_date):
+    """Create a row of data for an order, reusing the already-computed Jalali date."""
     billing = order['billing']
     shipping = order['shipping']
-    shipping_total = sum(float(item['total']) for item in order['shipping_lines'] if item['total'].replace('.', '', 1).isdigit())
+    shipping_total = sum(_to_float(item['total']) for item in order['shipping_lines'])
 
-    if order['date_paid']:
-        jalali_date, time_part = convert_to_jalali(order['date_paid'])
+    if jalali_date:
         date_part = f"{jalali_date.year}/{jalali_date.month:02d}/{jalali_date.day:02d}"
     else:
         date_part = ''
     
-    address_1 = shipping['address_1'].translate(persian_to_english)
-    address_1 = address_1.translate(arabic_to_english)
+    # Parsed once and stashed; the style pass reads it back for the red flag.
+    discount_int = int(float(order['discount_total'] or 0))
+    order['_discount_int'] = discount_int
+
+    address_1 = shipping['address_1'].translate(digit_translate)
 
-    birthday = find_meta_value(order, '_billing_field_529')
-    birthday = birthday.translate(persian_to_english)
-    birthday = birthday.translate(arabic_to_english)
+    meta = order_meta(order)
+    birthday = meta.get('_billing_field_529')
+    birthday = birthday.translate(digit_translate)
 
     return [
         order['id'],
@@ -220,284 +230,225 @@ def create_order_row(order):
         str(shipping['postcode']),
         int(order['total']) * 10,
         int(shipping_total) * 10,
-        int(order['discount_total']) * 10,
-        round(int(order['discount_total']) * 10 / 1.10),
+        discount_int * 10,
+        round(discount_int * 10 / 1.10),
         '', '', '', '', '',
-        find_meta_value(order, 'datei'),
-        find_meta_value(order, 'marsule'), '', '',
-        find_meta_value(order, 'datedeliver')
+        meta.get('datei'),
+        meta.get('marsule'), '', '',
+        meta.get('datedeliver')
     ]
 
-def write_products(sheet, line_items):
-    """Write product line items to the sheet."""
-    for item in line_items:
-        product_row = [''] * 15 + [str(item['sku']), item['name'], item['quantity'], int(item['total']) * 10]
-        sheet.append(product_row)
-        sheet.cell(row=sheet.max_row, column=list(COLUMN_HEADERS.keys()).index("item_total") + 1).number_format = '#,0'
-        
-        for col in range(list(COLUMN_HEADERS.keys()).index("sepidar_discount") + 1, list(COLUMN_HEADERS.keys()).index("sepidar_id") + 2):
-            sheet[sheet.max_row][col - 1].border = borders["right_border"]
-
-def count_integer_rows(sheet, column_name: str, start_row: int, stop_row: int) -> int:
-    """
-    Count the number of rows in the given sheet that have any integer value in the specified column
-    between the start_row and stop_row.
-
-    Args:
-        sheet: The Excel sheet to search through.
-        column_name: The name of the column to check.
-        start_row: The row number to start counting from (1-based index).
-        stop_row: The row number to stop counting at (1-based index).
-
-    Returns:
-        int: The count of rows that contain any integer in the specified column.
-    """
-    # Get the index of the column
-    headers = [cell.value for cell in sheet[1]]  # Assuming the first row is headers
-    if column_name not in headers:
-        raise ValueError(f"Column '{column_name}' not found in the sheet.")
-
-    column_index = headers.index(column_name) + 1  # +1 for 1-based index
-
-    count = 0
-    # Iterate through rows from start_row to stop_row
-    for row in sheet.iter_rows(min_row=start_row, max_row=stop_row):  # Adjust as necessary
-        if isinstance(row[column_index - 1].value, int):  # Check if the cell contains an integer
-            count += 1
-
-    return count
-
-def add_sum_row(sheet, from_row, last_row, col_list):
-    """Add a sum row after the last order of the Jalali month."""
-    sum_row_index = last_row + 1
-    sheet.insert_rows(sum_row_index)
-
-    for cell in sheet[sum_row_index]:
-        cell.border = borders["top_border"]
-    
-    # Set the label for the sum row
-    sheet.cell(row=sum_row_index, column=list(COLUMN_HEADERS.keys()).index('address') + 1, value=TEXT['sum_month_orders_row_text'])  # Adjust column index for label
-
-    lastmonth_orders_count = count_integer_rows(sheet, COLUMN_HEADERS['order_id'], from_row, last_row)
-    sheet.cell(row=sum_row_index, column=list(COLUMN_HEADERS.keys()).index('postcode') + 1, value=lastmonth_orders_count)
-
-    """Calculate totals for specified columns in the sheet."""
-    column_indices = {name: list(COLUMN_HEADERS.keys()).index(name) + 1 for name in col_list}
-
-    # Add sum formulas for each specified column
-    for column_name, column_index in column_indices.items():
-        if column_name == 'address' or column_name == 'postcode':
-            continue
-        sum_formula = f'=SUM({get_column_letter(column_index)}{from_row}:{get_column_letter(column_index)}{last_row})'
-        sheet.cell(row=sum_row_index, column=column_index, value=sum_formula)
-
-    # Apply styles to the sum row
-    for col in col_list:
-        cell = sheet.cell(row=sum_row_index, column=list(COLUMN_HEADERS.keys()).index(col) + 1)
-        cell.number_format = '#,0'
-
-    for cell in sheet[sum_row_index]:
-        cell.border = borders["all_borders"]
-        cell.fill = color["sum_row_bg"]
-        if cell.column == 11:
-            cell.alignment = Alignment(horizontal='center')
-    return sum_row_index
-
-def find_sum_rows(sheet) -> List[List[float]]:
-    """Find sum rows in the Excel sheet and return their integer and float values."""
-    address_index = list(COLUMN_HEADERS.keys()).index('address')
-    sum_row_indices = []
-    for row in sheet.iter_rows(min_row=2):  # Assuming the first row is headers
-        if row[address_index].value == TEXT['sum_month_orders_row_text']: # Adjust this condition based on your identifier
-            sum_row_indices.append(row[0].row)  # Append the actual row number
-    if not sum_row_indices:
-        logging.warning("No sum rows found.")
-
-    return sum_row_indices
+def build_product_rows(line_items):
+    """Build the product rows for an order without touching the sheet."""
+    return [
+        [''] * 15 + [str(item['sku']), item['name'], item['quantity'], int(item['total']) * 10]
+        for item in line_items
+    ]
 
 def calculate_totals(sheet, sum_rows, col_list):
-    # Assuming COLUMN_HEADERS is defined and contains the necessary keys
-    column_indices = {name: list(COLUMN_HEADERS.keys()).index(name) + 1 for name in col_list}
     col_total = {}
 
     # Iterate over each key to construct the formula
-    for key in column_indices.keys():
+    for key in col_list:
         col_total[key] = '='  # Initialize the formula for each key
-        formula_parts = [f"{get_column_letter(column_indices[key])}{i}" for i in sum_rows]  # Create cell references
+        formula_parts = [f"{COL_LETTER[key]}{i}" for i in sum_rows]  # Create cell references
         col_total[key] += " + ".join(formula_parts)  # Join them into a single formula
-    
-    return col_total
-
-def append_totals(sheet, col_total, col_list):
-    totals_row = ['', '', '', '', '', '', '', '', '', TEXT['sum_all_orders_row_text'], col_total["postcode"],
-        col_total["total"], col_total["shipping"], col_total["discount"],
-        col_total["sepidar_discount"], '', '', '', col_total["item_total"], '', '', '',
-        col_total["com_postal_payment"], col_total["com_postage"]]
-    sheet.append(totals_row)
 
-    for cell in sheet[sheet.max_row]:
-        cell.border = borders["top_border"]
-
-    for col in col_list:
-        cell = sheet.cell(row=sheet.max_row, column=list(COLUMN_HEADERS.keys()).index(col) + 1)
-        cell.number_format = '#,0'
-    
-    for cell in sheet[sheet.max_row]:
-        cell.border = borders["all_borders"]
-        cell.fill = color["total_sum_bg"]
-        if cell.column == 11:
-            cell.alignment = Alignment(horizontal='center')
+    return col_total
 
-def write_to_excel(excel_file: str, orders: list) -> None:
-    """Write JSON data to an Excel file."""
+def save_workbook(workbook, excel_file: str) -> None:
+    """Save the workbook, reporting the usual failure modes."""
+    logging.info(f"Saving data to {excel_file}...")
     try:
-        workbook = load_workbook(excel_file)
-        sheet = workbook.active
-    except FileNotFoundError:
-        logging.warning(f"The file {excel_file} does not exist. A new file will be created.")
-        workbook = Workbook()
-        sheet = workbook.active
+        workbook.save(excel_file)
+        logging.info(f"Data has been appended to {excel_file}.")
+    except PermissionError:
+        logging.error(f"Permission denied: Unable to save to {excel_file}. Please close the file if it's open.")
     except IOError as io_err:
-        logging.error(f"I/O error occurred while accessing {excel_file}: {io_err}")
-        return
+        logging.error(f"I/O error occurred while saving {excel_file}: {io_err}")
     except Exception as e:
-        logging.error(f"An unexpected error occurred while opening {excel_file}: {e}")
-        return
-
-    if sheet.max_row == 1:
-        sheet.append(list(COLUMN_HEADERS.values()))
-        logging.info("Write header row.")
-        for cell in sheet[sheet.max_row]:
-            cell.border = borders["all_borders"]
-            cell.fill = color["header_bg"]
-
-    if sheet.max_row > 1:
-        sheet.delete_rows(sheet.max_row)
-        logging.info(f"Removed last month orders row {sheet.max_row}.")
-        sheet.delete_rows(sheet.max_row)
-        logging.info(f"Removed total orders row {sheet.max_row}.")
-
-    existing_order_ids = {
-        sheet.cell(row=row, column=list(COLUMN_HEADERS.keys()).index("order_id") + 1).value: row
-        for row in range(2, sheet.max_row + 1)
-    }
+        logging.error(f"Failed to save the Excel file: {e}")
 
-    existing_order_ids = {k: v for k, v in existing_order_ids.items() if k is not None}
+def write_new_workbook(excel_file: str, orders: list) -> None:
+    """Stream all orders into a brand-new workbook in openpyxl write-only mode.
 
-    last_order_jalali_month = None
-    col_list =[
-        "address",
-        "postcode",
-        "total", 
-        "shipping", 
-        "discount", 
-        "sepidar_discount", 
-        "item_total", 
-        "com_postal_payment", 
-        "com_postage"
-    ]
+    Write-only mode keeps O(1) rows resident instead of materializing every
+    Cell, so the bulk-insert path is not bound by openpyxl cell overhead.
+    Styles must be set before a row is appended and counts/sum rows are
+    tracked inline because rows cannot be revisited.
+    """
+    workbook = Workbook(write_only=True)
+    register_named_styles(workbook)
+    sheet = workbook.create_sheet()
+
+    header_cells = []
+    for header in COLUMN_HEADERS.values():
+        cell = WriteOnlyCell(sheet, value=header)
+        cell.style = "header"
+        header_cells.append(cell)
+    sheet.append(header_cells)
+    logging.info("Write header row.")
+
+    col_list = SUM_COLUMNS
+
+    row_index = 1
     from_row = 2
+    month_orders_count = 0
     sum_row_indices = []
-    new_orders_count = 0
+    last_order_jalali_month = None
 
-    logging.info(f"Total Orders: {len(orders)}, Existed Orders: {len(existing_order_ids)}")
+    def emit_sum_row():
+        """Append the sum row for the month that just ended."""
+        nonlocal row_index, from_row, month_orders_count
+        row_index += 1
+        cells = []
+        for name, column in COL_IDX1.items():
+            if name == 'address':
+                value = TEXT['sum_month_orders_row_text']
+            elif name == 'postcode':
+                value = month_orders_count
+            elif name in col_list:
+                value = f'=SUM({COL_LETTER[name]}{from_row}:{COL_LETTER[name]}{row_index - 1})'
+            else:
+                value = None
+            cell = WriteOnlyCell(sheet, value=value)
+            cell.style = "sum_row_money" if name in col_list else "sum_row"
+            if column == 11:
+                cell.alignment = Alignment(horizontal='center')
+            cells.append(cell)
+        sheet.append(cells)
+        sum_row_indices.append(row_index)
+        from_row = row_index + 1
+        month_orders_count = 0
 
     for order in orders:
-        order_id = order['id']
         jalali_date, time_part = convert_to_jalali(order['date_paid'])
         current_order_jalali_month = f"{jalali_date.year}-{jalali_date.month:02d}"
         if last_order_jalali_month == None:
             last_order_jalali_month = current_order_jalali_month
 
-        if order_id in existing_order_ids:
-            row_index = existing_order_ids[order_id]
-
-            current_status = order['status']
-            lang_existing_status = sheet.cell(row=row_index, column=list(COLUMN_HEADERS.keys()).index("status") + 1).value
-            existing_status = get_key_by_value(STATUS, lang_existing_status)
-            
-            if existing_status != current_status:
-                logging.info(f"Order ID {order_id} status changed from {STATUS.get(existing_status)} to {STATUS.get(current_status)}. Updating...")
-                sheet.cell(row=row_index, column=list(COLUMN_HEADERS.keys()).index("status") + 1).value = STATUS.get(current_status)
-                # apply_styles(sheet, row_index, order)  # Reapply styles if necessary
-                
-            existing_datei = sheet.cell(row=row_index, column=list(COLUMN_HEADERS.keys()).index("datei") + 1).value
-            current_datei = find_meta_value(order, 'datei')
-
-            if current_datei != existing_datei:
-                logging.info(f"Order ID {order_id} send date changed from {existing_datei} to {current_datei}. Updating...")
-                sheet.cell(row=row_index, column=list(COLUMN_HEADERS.keys()).index("datei") + 1).value = current_datei
-                
-            existing_tracking_code = sheet.cell(row=row_index, column=list(COLUMN_HEADERS.keys()).index("tracking_code") + 1).value
-            current_tracking_code = find_meta_value(order, 'marsule')
-            if current_tracking_code != existing_tracking_code:
-                logging.info(f"Order ID {order_id} tracking code changed from {existing_tracking_code} to {current_tracking_code}. Updating...")
-                sheet.cell(row=row_index, column=list(COLUMN_HEADERS.keys()).index("tracking_code") + 1).value = current_tracking_code
-
-            existing_delivery_date = sheet.cell(row=row_index, column=list(COLUMN_HEADERS.keys()).index("delivery_date") + 1).value
-            current_delivery_date = find_meta_value(order, 'datedeliver')
-            if current_delivery_date != existing_delivery_date:
-                logging.info(f"Order ID {order_id} delivery date changed from {existing_delivery_date} to {current_delivery_date}. Updating...")
-                sheet.cell(row=row_index, column=list(COLUMN_HEADERS.keys()).index("delivery_date") + 1).value = current_delivery_date
-
-            last_order_jalali_month = current_order_jalali_month
-            continue
-
-        new_orders_count +=1
-
-        # Check if we need to add a sum row for the previous month
         if current_order_jalali_month != last_order_jalali_month:
             logging.info(f"add a sum row for the {last_order_jalali_month} month")
-            sum_row_indices.append(add_sum_row(sheet, from_row, sheet.max_row, col_list))
-            from_row = sheet.max_row + 1
+            emit_sum_row()
             last_order_jalali_month = current_order_jalali_month
 
-        order_row = create_order_row(order)
-        sheet.append(order_row)
-        row_index = sheet.max_row
-        
-        logging.info(f"Order ID {order_id} written in Excel row.")
-        apply_styles(sheet, row_index, order)
-        write_products(sheet, order['line_items'])
-
-        # Calculate com_postage
-        com_postage_cell_index = list(COLUMN_HEADERS.keys()).index("com_postage") + 1
-        com_postage_value = f"=M{row_index} - W{row_index}"
-        sheet.cell(row=row_index, column=com_postage_cell_index, value=com_postage_value)
-
-    # sum_rows = find_sum_rows(sheet)
-    # if new_orders_count and last_order_jalali_month and len(sum_rows) > 1 and sum_rows[-1] <  sheet.max_row - 1 :
-    #     sheet.delete_rows(sum_rows[-1])
-    #     logging.info("Removed last month orders sum row.")
-
-    # Add last month sum row if necessary
-    # if len(orders) != len(existing_order_ids):
-    # if last_order_jalali_month and new_orders_count > 0:
-        # sheet.delete_rows(sum_rows[-1])
-    # logging.info("Removed last month orders sum row.")
-    sum_rows = find_sum_rows(sheet)
-    add_sum_row(sheet, sum_rows[-1] + 1, sheet.max_row, col_list)
-    sum_row_indices.append(sheet.max_row)
-    logging.info(f"New Orders : {new_orders_count}")
-    logging.info("Written last month orders sum row.")
-    
-    sum_rows = find_sum_rows(sheet)
-
-    col_total = calculate_totals(sheet, sum_rows, col_list)
-    append_totals(sheet, col_total, col_list)
+        order_row = create_order_row(order, jalali_date)
+        row_index += 1
+        order_row[COL_IDX0["com_postage"]] = f"=M{row_index} - W{row_index}"
+        discount_flagged = order['_discount_int'] > 0
+
+        cells = []
+        for column, value in enumerate(order_row, start=1):
+            cell = WriteOnlyCell(sheet, value=value)
+            if column in MONEY_COLS:
+                cell.style = "money_order"
+            elif column in TEXT_COLS:
+                cell.style = "text_order"
+            else:
+                cell.style = "order_cell"
+            if discount_flagged and column == COL_IDX1["sepidar_discount"]:
+                cell.fill = color["red_bg"]
+            cells.append(cell)
+        sheet.append(cells)
+        month_orders_count += 1
+        logging.info(f"Order ID {order['id']} written in Excel row.")
+
+        for product_row in build_product_rows(order['line_items']):
+            row_index += 1
+            product_cells = []
+            # The trailing '' gives the sepidar_id column a cell to border.
+            for column, value in enumerate(product_row + [''], start=1):
+                cell = WriteOnlyCell(sheet, value=value)
+                if column == COL_IDX1["item_total"]:
+                    cell.number_format = '#,0'
+                if COL_IDX1["sepidar_discount"] <= column <= COL_IDX1["sepidar_id"]:
+                    cell.border = borders["right_border"]
+                product_cells.append(cell)
+            sheet.append(product_cells)
+
+    if last_order_jalali_month is not None:
+        emit_sum_row()
+        logging.info("Written last month orders sum row.")
+
+    col_total = calculate_totals(sheet, sum_row_indices, col_list)
+    totals_cells = []
+    for name, column in COL_IDX1.items():
+        if name == 'address':
+            value = TEXT['sum_all_orders_row_text']
+        elif name in col_list:
+            value = col_total[name]
+        else:
+            value = None
+        cell = WriteOnlyCell(sheet, value=value)
+        cell.style = "total_sum_money" if name in col_list else "total_sum"
+        if column == 11:
+            cell.alignment = Alignment(horizontal='center')
+        totals_cells.append(cell)
+    sheet.append(totals_cells)
     logging.info("Written total orders row.")
 
-    logging.info(f"Saving data to {excel_file}...")
+    save_workbook(workbook, excel_file)
+
+def trim_order(order):
+    """Keep only the fields the writer reads, so the order state stays small."""
+    meta = order_meta(order)
+    return {
+        'id': order['id'],
+        'status': order['status'],
+        'date_paid': order['date_paid'],
+        'customer_id': order['customer_id'],
+        'billing': order['billing'],
+        'shipping': order['shipping'],
+        'shipping_lines': [{'total': item['total']} for item in order['shipping_lines']],
+        'total': order['total'],
+        'discount_total': order['discount_total'],
+        'meta_data': [{'key': key, 'value': meta.get(key)}
+                      for key in ('_billing_field_529', 'datei', 'marsule', 'datedeliver')],
+        'line_items': [{'sku': item['sku'], 'name': item['name'],
+                        'quantity': item['quantity'], 'total': item['total']}
+                       for item in order['line_items']]
+    }
 
+def load_order_state(state_file: str) -> dict:
+    """Load the cached orders from the sidecar file, keyed by order id."""
     try:
-        workbook.save(excel_file)
-        logging.info(f"Data has been appended to {excel_file}.")
-    except PermissionError:
-        logging.error(f"Permission denied: Unable to save to {excel_file}. Please close the file if it's open.")
+        with open(state_file, 'r', encoding='utf-8') as file:
+            return {order['id']: order for order in json.load(file)}
+    except FileNotFoundError:
+        logging.warning(f"No order state found at {state_file}. The workbook will only contain fetched orders.")
+        return {}
+    except (json.JSONDecodeError, KeyError, TypeError) as e:
+        logging.error(f"Could not read order state {state_file}: {e}. Starting fresh.")
+        return {}
+
+def save_order_state(state_file: str, orders_by_id: dict) -> None:
+    """Persist the merged orders to the sidecar file for the next run."""
+    try:
+        with open(state_file, 'w', encoding='utf-8') as file:
+            json.dump(list(orders_by_id.values()), file, ensure_ascii=False)
+        logging.info(f"Order state saved to {state_file}.")
     except IOError as io_err:
-        logging.error(f"I/O error occurred while saving {excel_file}: {io_err}")
-    except Exception as e:
-        logging.error(f"Failed to save the Excel file: {e}")
+        logging.error(f"Failed to save order state {state_file}: {io_err}")
+
+def write_to_excel(excel_file: str, orders: list, state_file: str = "orders_state.json") -> None:
+    """Merge fetched orders into the cached state and regenerate the workbook.
+
+    Loading the old .xlsx just to update a few cells parses every cell ever
+    written, which grows with the file's whole history. The sidecar JSON holds
+    the trimmed orders instead: fetched orders overwrite their cached version,
+    everything is streamed through the write-only path, and the sheet layout
+    (month sum rows, grand totals) falls out of the single pass.
+    """
+    orders_by_id = load_order_state(state_file)
+    cached_count = len(orders_by_id)
+    for order in orders:
+        orders_by_id[order['id']] = trim_order(order)
+
+    merged_orders = sorted(orders_by_id.values(), key=lambda order: int(order['id']))
+    logging.info(f"Total Orders: {len(orders)}, Cached Orders: {cached_count}, Writing: {len(merged_orders)}")
+
+    write_new_workbook(excel_file, merged_orders)
+    save_order_state(state_file, orders_by_id)
 
 def open_excel_file(file_path):
     """Open the specified Excel file."""
@@ -524,11 +475,28 @@ if __name__ == "__main__":
         ]
     )
 
-    # Translation tables
-    persian_to_english = str.maketrans('۰۱۲۳۴۵۶۷۸۹', '0123456789')
-    arabic_to_english = str.maketrans('٠١٢٣٤٥٦٧٨٩', '0123456789')
-
-    lang, wc_api, days_to_fetch, color, borders, fonts = load_config('config.json')
+    # One table covering Persian and Arabic digits; each string is scanned once.
+    digit_translate = str.maketrans('۰۱۲۳۴۵۶۷۸۹٠١٢٣٤٥٦٧٨٩', '01234567890123456789')
+
+    lang, wc_api, days_to_fetch, color, borders, fonts, styles = load_config('config.json')
+
+    # One pooled session for every WooCommerce call; the library sends each
+    # request through woocommerce.api.request, so route that via the session
+    # to keep TCP/TLS connections alive across pages.
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=10, pool_maxsize=20)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    woocommerce.api.request = session.request
+
+    wc_client = API(
+        url=wc_api['URL'],
+        consumer_key=wc_api['KEY'],
+        consumer_secret=wc_api['SECRET'],
+        wp_api=True,
+        version="wc/v3",
+        timeout=wc_api['TIMEOUT'],
+    )
     if lang['lang'] == "en":
         from mapping import STATES, ENGLISH_COLUMN_HEADERS, ENGLISH_STATUS, ENGLISH_TEXT
         COLUMN_HEADERS = ENGLISH_COLUMN_HEADERS
@@ -542,6 +510,16 @@ if __name__ == "__main__":
     else:
         logging.error(f"Missing language configuration in config.json")
 
+    # Precomputed column lookups; COLUMN_HEADERS never changes after this point.
+    COL_IDX0 = {name: index for index, name in enumerate(COLUMN_HEADERS)}
+    COL_IDX1 = {name: index + 1 for index, name in enumerate(COLUMN_HEADERS)}
+    COL_LETTER = {name: get_column_letter(index + 1) for index, name in enumerate(COLUMN_HEADERS)}
+
+    # Column-index sets driving the per-row style dispatch in the writer.
+    MONEY_COLS = frozenset(COL_IDX1[col] for col in
+                           ("total", "shipping", "discount", "sepidar_discount", "com_postal_payment", "com_postage"))
+    TEXT_COLS = frozenset(COL_IDX1[col] for col in ("date_paid", "phone", "postcode"))
+
     all_orders = fetch_orders()
     # Filter out cancelled orders
     orders = [order for order in all_orders if order['status'] != 'cancelled' and order['status'] != 'pending']